@@ -2,15 +2,32 @@
 
 from __future__ import annotations
 
+import copy
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, AbstractSet, Iterable, Optional, Sequence
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Hashable,
+    Iterable,
+    Optional,
+    Sequence,
+)
 
 if TYPE_CHECKING:
     from pmtypes import MachineState, Transaction
 
 
 class ObjSet(AbstractSet[int]):
-    """Set data structure for memory objects (addresses)."""
+    """Set data structure for memory objects (addresses).
+
+    Attributes:
+        bits: bit vector representation of the set; two sets intersect if and only
+              if their bit vectors do
+    """
+
+    __slots__ = ()
+
+    bits: int
 
     @abstractmethod
     def __or__(self, other: AbstractSet) -> ObjSet:
@@ -38,6 +55,22 @@ class ObjSetMaker(ABC):
     def free_objects(self, objects: Iterable[int]) -> None:
         """Free resources associated with objects in the set."""
 
+    def snapshot(self) -> ObjSetMaker:
+        """Return a copy whose state can be changed independently of this one.
+
+        The default makes a deep copy, subclasses can share or copy less.
+        """
+        return copy.deepcopy(self)
+
+    def fingerprint(self) -> Hashable:
+        """Return a hashable summary of the state of this maker.
+
+        Makers with equal fingerprints make the same sets from now on. The default
+        never matches another maker, so states using it are never skipped as
+        duplicates. Stateless makers can return a constant such as None.
+        """
+        return object()
+
     def free(self, transaction: Transaction) -> None:
         """Free resources associated with the transaction."""
         self.free_objects(transaction.read_set)
@@ -6,21 +6,20 @@ import typing
 from typing import Iterable
 
 from api import TransactionExecutor
-from pmtypes import Core, MachineState, Transaction
+from pmtypes import Core, MachineState, Transaction, trace_order
 
 
 class RandomExecutor(TransactionExecutor):
-    """Chooses random scheduled transactions to be executed on each free core."""
+    """Chooses arbitrary scheduled transactions to be executed on each free core."""
 
     def run(self, state: MachineState) -> Iterable[MachineState]:
         """See TransactionExecutor.push."""
-        # Execute one transaction.
+        # Execute the earliest transactions in the trace (not the ones that happen to
+        # come first in the set, which differs between equivalent states).
         state = state.copy()
-        while len(state.cores) < state.core_count:
-            try:
-                tr = state.scheduled.pop()
-            except KeyError:
-                break
+        n_free_cores = state.core_count - len(state.cores)
+        for tr in heapq.nsmallest(n_free_cores, state.scheduled, key=trace_order):
+            state.scheduled.remove(tr)
             core = Core(state.clock + tr.time, tr)
             heapq.heappush(state.cores, core)
         return [state]
@@ -38,12 +37,27 @@ class OptimalExecutor(TransactionExecutor):
         # Generate output state for each scheduled transaction combination.
         n_free_cores = state.core_count - len(state.cores)
         tr_combos = (
-            itertools.combinations(state.scheduled, n_free_cores)
+            itertools.combinations(
+                sorted(state.scheduled, key=trace_order), n_free_cores
+            )
             if n_free_cores < len(state.scheduled)
             else typing.cast(Iterable[Iterable[Transaction]], [state.scheduled])
         )
         out_states = []
+        seen = set()
         for tr_combo in tr_combos:
+            # Transactions with the same time and the same objects are
+            # interchangeable, so starting either of them leads to equivalent states.
+            # Only explore one combination from each such class.
+            signature = tuple(
+                sorted(
+                    (tr.time, tr.read_bits, tr.write_bits, tr.rename_steps)
+                    for tr in tr_combo
+                )
+            )
+            if signature in seen:
+                continue
+            seen.add(signature)
             new_state = state.copy()
             for tr in tr_combo:
                 new_core = Core(state.clock + tr.time, tr)
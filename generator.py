@@ -1,7 +1,10 @@
 """Classes that create transaction generators for Puppetmaster."""
 
+from __future__ import annotations
+
+import itertools
 import random
-from typing import Generator, List, Mapping, Optional, Sequence, Tuple
+from typing import Generator, Hashable, List, Mapping, Optional, Sequence, Tuple
 
 from api import ObjSetMaker
 from pmtypes import Transaction
@@ -25,10 +28,15 @@ class TransactionGenerator(Generator[Optional[Transaction], ObjSetMaker, None]):
         """
         self.tr_data = tr_data
         self.addresses = addresses
+        # Objects of transaction i are addresses[read_starts[i]:read_starts[i + 1]].
+        self.read_starts = list(
+            itertools.accumulate(
+                (conf["reads"] + conf["writes"] for _, conf in tr_data), initial=0
+            )
+        )
         self.tr_index = 0
-        self.address_index = 0
-        self.overflowed: List[Tuple[int, int]] = []
-        self.deferred: List[Tuple[int, int]] = []
+        self.overflowed: List[int] = []
+        self.deferred: List[int] = []
 
     def send(self, obj_set_maker: Optional[ObjSetMaker]) -> Optional[Transaction]:
         """Return next transaction.
@@ -39,21 +47,16 @@ class TransactionGenerator(Generator[Optional[Transaction], ObjSetMaker, None]):
         if obj_set_maker is None:
             obj_set_maker = IdealObjSetMaker()
         if self.deferred:
-            tr_base, address_base = self.deferred.pop(0)
-            tr_label, tr_conf = self.tr_data[tr_base]
-            read_start = address_base
-            read_end = write_start = read_start + tr_conf["reads"]
-            write_end = write_start + tr_conf["writes"]
+            tr_pos = self.deferred.pop(0)
         elif self.tr_index != len(self.tr_data):
-            tr_label, tr_conf = self.tr_data[self.tr_index]
+            tr_pos = self.tr_index
             self.tr_index += 1
-            read_start = self.address_index
-            self.address_index += tr_conf["reads"]
-            read_end = write_start = self.address_index
-            self.address_index += tr_conf["writes"]
-            write_end = self.address_index
         else:
             raise StopIteration
+        tr_label, tr_conf = self.tr_data[tr_pos]
+        read_start = self.read_starts[tr_pos]
+        read_end = write_start = read_start + tr_conf["reads"]
+        write_end = self.read_starts[tr_pos + 1]
         try:
             read_set = obj_set_maker(self.addresses[read_start:read_end])
             try:
@@ -64,13 +67,15 @@ class TransactionGenerator(Generator[Optional[Transaction], ObjSetMaker, None]):
                     rename_steps = sum(obj_set_maker.history[-tr_size:])
                 else:
                     rename_steps = 0
-                return Transaction(read_set, write_set, tr_label, tr_time, rename_steps)
+                return Transaction(
+                    read_set, write_set, tr_label, tr_time, rename_steps, tr_pos
+                )
             except ValueError:
                 # Remove the already inserted objects from the read set.
                 obj_set_maker.free_objects(read_set)
                 raise
         except ValueError:
-            self.overflowed.append((self.tr_index - 1, read_start))
+            self.overflowed.append(tr_pos)
             return None
 
     def throw(self, exception, value=None, traceback=None):
@@ -78,6 +83,21 @@ class TransactionGenerator(Generator[Optional[Transaction], ObjSetMaker, None]):
         self.tr_index = len(self.tr_data)
         return Generator.throw(exception, value, traceback)
 
+    def snapshot(self) -> TransactionGenerator:
+        """Return a copy whose state can be changed independently of this one."""
+        new = TransactionGenerator.__new__(TransactionGenerator)
+        new.tr_data = self.tr_data
+        new.addresses = self.addresses
+        new.read_starts = self.read_starts
+        new.tr_index = self.tr_index
+        new.overflowed = list(self.overflowed)
+        new.deferred = list(self.deferred)
+        return new
+
+    def fingerprint(self) -> Hashable:
+        """Return a hashable summary of the transactions that are still to come."""
+        return (self.tr_index, tuple(self.overflowed), tuple(self.deferred))
+
     def reset_overflows(self) -> None:
         """Adjust internal state to try overflowing transactions again."""
         self.deferred.extend(self.overflowed)
@@ -102,8 +122,7 @@ class TransactionGenerator(Generator[Optional[Transaction], ObjSetMaker, None]):
         """Return a string representation of this object."""
         return (
             f"{self.__class__.__name__}(tr_data={self.tr_data!r}, addresses="
-            f"{self.addresses!r}, tr_index={self.tr_index!r}, address_index="
-            f"{self.address_index!r})"
+            f"{self.addresses!r}, tr_index={self.tr_index!r})"
         )
 
     def __str__(self) -> str:
@@ -5,7 +5,18 @@ from __future__ import annotations
 import copy
 import dataclasses
 import itertools
-from typing import TYPE_CHECKING, Iterable, Iterator, List, MutableSet, Optional, Set
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    MutableSet,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from api import ObjSet, ObjSetMaker
 
@@ -13,7 +24,7 @@ if TYPE_CHECKING:
     from generator import TransactionGenerator
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class Transaction:
     """An atomic operation in the api."""
 
@@ -24,20 +35,49 @@ class Transaction:
     label: str = dataclasses.field(compare=False)
     time: int = dataclasses.field(compare=False)
     rename_steps: int = dataclasses.field(compare=False)
+    # Position in the trace, for transactions coming from a TransactionGenerator.
+    position: int = dataclasses.field(default=0, compare=False)
+    read_bits: int = dataclasses.field(init=False, compare=False, repr=False)
+    write_bits: int = dataclasses.field(init=False, compare=False, repr=False)
+    rw_bits: int = dataclasses.field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Cache the bit vectors of the read and write sets and their union."""
+        object.__setattr__(self, "read_bits", self.read_set.bits)
+        object.__setattr__(self, "write_bits", self.write_set.bits)
+        object.__setattr__(self, "rw_bits", self.read_bits | self.write_bits)
+
+
+def trace_order(transaction: Transaction) -> Tuple[int, int]:
+    """Return a key that sorts transactions by their position in the trace.
+
+    Ids (and the iteration order of sets, which depends on them) are handed out in
+    the order the search creates transactions, which differs between paths. Policies
+    that pick transactions in this order make the same decisions in equivalent states.
+    """
+    return (transaction.position, transaction.id)
 
 
 class TransactionSet(MutableSet[Transaction]):
-    """A set of transactions."""
+    """A set of transactions.
+
+    Attributes:
+        read_bits: union of the read set bit vectors of the transactions
+        write_bits: union of the write set bit vectors of the transactions
+        rw_bits: union of read_bits and write_bits
+    """
+
+    __slots__ = ("transactions", "read_bits", "write_bits", "rw_bits")
 
     transactions: Set[Transaction]
-    read_set: Optional[ObjSet] = None
-    write_set: Optional[ObjSet] = None
+    read_bits: int
+    write_bits: int
+    rw_bits: int
 
     def __init__(self, transactions: Iterable[Transaction] = (), /):
         """Create a new set."""
-        self.transactions = set()
-        for t in transactions:
-            self.add(t)
+        self.transactions = set(transactions)
+        self._update_bits()
 
     def __contains__(self, transaction: object) -> bool:
         """Return if the given transaction is in the set."""
@@ -62,34 +102,67 @@ class TransactionSet(MutableSet[Transaction]):
     def add(self, transaction: Transaction) -> None:
         """Add a new transaction to the set."""
         self.transactions.add(transaction)
-        if self.read_set is None:
-            self.read_set = transaction.read_set.copy()
-        else:
-            self.read_set |= transaction.read_set
-        if self.write_set is None:
-            self.write_set = transaction.write_set.copy()
-        else:
-            self.write_set |= transaction.write_set
+        self.read_bits |= transaction.read_bits
+        self.write_bits |= transaction.write_bits
+        self.rw_bits |= transaction.rw_bits
 
     def discard(self, transaction: Transaction) -> None:
         """Remove a transaction from the set.
 
-        Warning: does not update the combined read and write sets.
+        This takes time linear in the size of the set, so bulk removals should use
+        clear() or -= instead of repeated calls.
         """
-        self.transactions.discard(transaction)
+        if transaction not in self.transactions:
+            return
+        self.transactions.remove(transaction)
+        # Other transactions might share objects with this one, so recompute.
+        self._update_bits()
+
+    def clear(self) -> None:
+        """Remove all transactions from the set."""
+        self.transactions.clear()
+        self.read_bits = self.write_bits = self.rw_bits = 0
+
+    def __isub__(self, transactions: AbstractSet) -> TransactionSet:
+        """Remove the given transactions from the set."""
+        if transactions is self:
+            self.clear()
+        else:
+            self.transactions.difference_update(transactions)
+            self._update_bits()
+        return self
+
+    def _update_bits(self) -> None:
+        """Recompute the combined bit vectors from the transactions in the set."""
+        read_bits = write_bits = 0
+        for tr in self.transactions:
+            read_bits |= tr.read_bits
+            write_bits |= tr.write_bits
+        self.read_bits = read_bits
+        self.write_bits = write_bits
+        self.rw_bits = read_bits | write_bits
 
     def compatible(self, transaction: Transaction) -> bool:
         """Return True if the transaction is compatible with the ones in this set."""
-        if not self.transactions or self.read_set is None or self.write_set is None:
-            return True
-        return (
-            not (transaction.read_set & self.write_set)
-            and not (transaction.write_set & self.read_set)
-            and not (transaction.write_set & self.write_set)
+        # Writes conflict with both reads and writes, so check them in one go.
+        return not (
+            transaction.read_bits & self.write_bits
+            or transaction.write_bits & self.rw_bits
         )
 
+    def filter_compatible(
+        self, transactions: Iterable[Transaction]
+    ) -> List[Transaction]:
+        """Return the transactions that are compatible with the ones in this set."""
+        write_bits, rw_bits = self.write_bits, self.rw_bits
+        return [
+            tr
+            for tr in transactions
+            if not (tr.read_bits & write_bits or tr.write_bits & rw_bits)
+        ]
+
 
-@dataclasses.dataclass(order=True)
+@dataclasses.dataclass(eq=False, slots=True)
 class Core:
     """Component executing a single transaction.
 
@@ -101,10 +174,14 @@ class Core:
     """
 
     clock: int
-    transaction: Transaction = dataclasses.field(compare=False)
+    transaction: Transaction
 
+    def __lt__(self, other: Core) -> bool:
+        """Return True if this core finishes before the other one (for heapq)."""
+        return self.clock < other.clock
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class MachineState:
     """Represents the full state of the machine. Useful for state space search."""
 
@@ -124,14 +201,40 @@ class MachineState:
         """Make a 1-deep copy of this object.
 
         Collection fields are recreated, but the contained object will be the same.
+        Generators without a snapshot method (e.g., ones written before it existed)
+        are deep-copied.
         """
-        new = copy.copy(self)
-        new.obj_set_maker = copy.copy(self.obj_set_maker)
-        new.incoming = copy.copy(self.incoming)
-        new.pending = set(self.pending)
-        new.scheduled = set(self.scheduled)
-        new.cores = list(Core(c.clock, c.transaction) for c in self.cores)
-        return new
+        snapshot = getattr(self.incoming, "snapshot", None)
+        return MachineState(
+            copy.deepcopy(self.incoming) if snapshot is None else snapshot(),
+            self.obj_set_maker.snapshot(),
+            set(self.pending),
+            set(self.scheduled),
+            self.core_count,
+            [Core(c.clock, c.transaction) for c in self.cores],
+            self.clock,
+        )
+
+    def fingerprint(self) -> Hashable:
+        """Return a hashable summary of this state.
+
+        States with equal fingerprints hold the same transactions, wait for the same
+        trace positions and have object set makers in the same state, so it is enough
+        to explore only one of them during state space search. The iteration order
+        of their sets can still differ, so policies have to look at transactions in
+        trace_order to behave the same way in both. States with generators that
+        don't have a fingerprint method are never considered equal.
+        """
+        # Calling the object type makes a fresh instance, which equals nothing else.
+        incoming_fingerprint = getattr(self.incoming, "fingerprint", object)
+        return (
+            self.clock,
+            incoming_fingerprint(),
+            self.obj_set_maker.fingerprint(),
+            frozenset(self.pending),
+            frozenset(self.scheduled),
+            tuple(sorted((c.clock, c.transaction.id) for c in self.cores)),
+        )
 
     def __str__(self):
         """Return user-friendly string representation of this object."""
@@ -2,12 +2,11 @@
 
 import heapq
 import itertools
-import math
 from abc import abstractmethod
-from typing import Iterable, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 from api import TransactionScheduler, TransactionSchedulerFactory
-from pmtypes import MachineState, Transaction, TransactionSet
+from pmtypes import MachineState, Transaction, TransactionSet, trace_order
 
 
 class AbstractScheduler(TransactionScheduler):
@@ -53,21 +52,40 @@ class AbstractScheduler(TransactionScheduler):
                 state.clock = state.cores[0].clock
             return [state]
         # Try scheduling a batch of new transactions.
-        ongoing = TransactionSet((core.transaction for core in state.cores))
-        for tr in state.scheduled:
-            ongoing.add(tr)
+        ongoing = TransactionSet(
+            itertools.chain((core.transaction for core in state.cores), state.scheduled)
+        )
         max_count = (
             None if self.queue_size is None else self.queue_size - len(state.scheduled)
         )
+        # Transactions conflicting with ongoing ones can't be scheduled by any policy.
+        available = ongoing.filter_compatible(sorted(state.pending, key=trace_order))
+        schedules = []
+        seen = set()
+        for scheduled, sched_steps in self.schedule(available, max_count):
+            # Different alternatives can be equal (e.g., after truncation to max_count),
+            # but they would lead to the same states.
+            key = (frozenset(scheduled), sched_steps)
+            if key not in seen:
+                seen.add(key)
+                schedules.append((scheduled, sched_steps))
         out_states = []
-        for scheduled, sched_steps in self.schedule(ongoing, state.pending, max_count):
-            new_state = state.copy()
+        for i, (scheduled, sched_steps) in enumerate(schedules):
+            if i < len(schedules) - 1:
+                new_state = state.copy()
+            else:
+                # The last alternative can reuse this (already copied) state. Its sets
+                # are still rebuilt, so that they iterate in the same order as copies
+                # (which later scheduling and execution decisions depend on).
+                new_state = state
+                new_state.pending = set(state.pending)
+                new_state.scheduled = set(state.scheduled)
             cycles = sched_steps
             new_state.clock += self.clock_period * cycles
             if scheduled:
                 new_state.scheduled.update(scheduled)
                 new_state.pending.difference_update(scheduled)
-            elif new_state.clock < new_state.cores[0].clock:
+            elif new_state.cores and new_state.clock < new_state.cores[0].clock:
                 # Scheduler needs to wait until at least one transaction finishes.
                 new_state.clock = new_state.cores[0].clock
             out_states.append(new_state)
@@ -76,46 +94,73 @@ class AbstractScheduler(TransactionScheduler):
     @abstractmethod
     def schedule(
         self,
-        ongoing: TransactionSet,
         pending: Iterable[Transaction],
         max_count: Optional[int],
     ) -> Iterable[Tuple[TransactionSet, int]]:
-        """Return set of scheduled transactions and number of steps taken."""
+        """Return set of scheduled transactions and number of steps taken.
+
+        Arguments:
+            pending: transactions to choose from, all compatible with the ones that
+                     are already scheduled or running
+            max_count: maximum number of transactions to schedule (None if unlimited)
+        """
 
 
 class GreedyScheduler(AbstractScheduler):
     """Implementation of a simple scheduler."""
 
+    smallest_first: bool = False
+
     def schedule(
         self,
-        ongoing: TransactionSet,
         pending: Iterable[Transaction],
         max_count: Optional[int],
     ) -> Iterable[Tuple[TransactionSet, int]]:
         """See AbstractScheduler.schedule.
 
         Iterates through pending transactions once and adds all compatible ones.
+        If smallest_first is set, transactions accessing fewer objects (which are
+        less likely to conflict) are tried first.
         """
-        candidates = TransactionSet()
+        if self.smallest_first:
+            pending = sorted(pending, key=lambda tr: tr.rw_bits.bit_count())
+        # Objects that pending transactions must not write (read or written by an
+        # already chosen transaction) and must not read (written by one).
+        rw_bits = write_bits = 0
+        chosen = []
         for tr in pending:
-            if ongoing.compatible(tr) and candidates.compatible(tr):
-                candidates.add(tr)
-                if max_count is not None and len(candidates) == max_count:
+            if not (tr.read_bits & write_bits or tr.write_bits & rw_bits):
+                chosen.append(tr)
+                rw_bits |= tr.rw_bits
+                write_bits |= tr.write_bits
+                if len(chosen) == max_count:
                     break
-        return [(candidates, 1)]
+        return [(TransactionSet(chosen), 1)]
 
 
 class GreedySchedulerFactory(TransactionSchedulerFactory):
     """Factory for greedy schedulers."""
 
+    def __init__(self, smallest_first=False):
+        """Initialize the factory.
+
+        Arguments:
+            smallest_first: whether transactions with fewer objects are tried first
+        """
+        self.smallest_first = smallest_first
+
     def __call__(
         self, clock_period: int = 0, pool_size: int = None, queue_size: int = None
     ) -> GreedyScheduler:
         """See TransactionSchedulerFactory.__call__."""
-        return GreedyScheduler(clock_period, pool_size, queue_size)
+        sched = GreedyScheduler(clock_period, pool_size, queue_size)
+        sched.smallest_first = self.smallest_first
+        return sched
 
     def __str__(self) -> str:
         """Return human-readable name for the schedulers."""
+        if self.smallest_first:
+            return "Greedy scheduler (smallest first)"
         return "Greedy scheduler"
 
 
@@ -126,32 +171,66 @@ class MaximalScheduler(AbstractScheduler):
 
     def schedule(
         self,
-        ongoing: TransactionSet,
         pending: Iterable[Transaction],
         max_count: Optional[int],
     ) -> Iterable[Tuple[TransactionSet, int]]:
-        """See AbstractScheduler.schedule."""
-        pending_list = list(pending)
+        """See AbstractScheduler.schedule.
 
-        def all_candidate_sets(prefix, i):
-            if i == len(pending_list):
-                yield prefix
-                return
-            yield from all_candidate_sets(prefix, i + 1)
-            tr = pending_list[i]
-            if ongoing.compatible(tr) and prefix.compatible(tr):
-                new_prefix = TransactionSet(prefix)
-                new_prefix.add(tr)
-                yield from all_candidate_sets(new_prefix, i + 1)
-
-        candidate_sets = all_candidate_sets(TransactionSet(), 0)
-        candidate_sets = heapq.nlargest(self.n_schedules, candidate_sets, key=len)
-        if max_count is None:
-            return [(candidates, 1) for candidates in candidate_sets]
-        return [
-            (TransactionSet(itertools.islice(candidates, max_count)), 1)
-            for candidates in candidate_sets
-        ]
+        Runs a depth-first branch-and-bound search over bit masks of pending
+        transactions, skipping subtrees that can't produce a set larger than the
+        current n_schedules largest ones. Ties are broken the same way as with an
+        exhaustive search, in favor of sets that exclude earlier transactions.
+        """
+        pending_list = list(pending)
+        # Bit j of conflicts[i] is set if transactions i and j can't run together
+        # (including j == i, so that adding a transaction removes it from candidates).
+        conflicts = []
+        for i, tr in enumerate(pending_list):
+            mask = 1 << i
+            for j, other in enumerate(pending_list):
+                if tr.read_bits & other.write_bits or tr.write_bits & other.rw_bits:
+                    mask |= 1 << j
+            conflicts.append(mask)
+
+        # Min-heap of (size, -order found, chosen), with the worst set on the top.
+        best: List[Tuple[int, int, int]] = []
+        found = 0
+        # Largest size reached with each candidate mask. If only the best set is
+        # needed, a node can be skipped if an earlier one had the same candidates
+        # and at least as many chosen transactions, it can't find a larger set.
+        reached: Optional[Dict[int, int]] = {} if self.n_schedules == 1 else None
+        stack = [(0, 0, (1 << len(pending_list)) - 1)]
+        while stack:
+            size, chosen, candidates = stack.pop()
+            if len(best) == self.n_schedules and (
+                size + candidates.bit_count() <= best[0][0]
+            ):
+                continue
+            if reached is not None:
+                if reached.get(candidates, -1) >= size:
+                    continue
+                reached[candidates] = size
+            if not candidates:
+                if len(best) < self.n_schedules:
+                    heapq.heappush(best, (size, -found, chosen))
+                else:
+                    heapq.heapreplace(best, (size, -found, chosen))
+                found += 1
+                continue
+            bit = candidates & -candidates
+            i = bit.bit_length() - 1
+            # Push the inclusive branch first, so that the exclusive one is explored
+            # (and its sets found) first.
+            stack.append((size + 1, chosen | bit, candidates & ~conflicts[i]))
+            stack.append((size, chosen, candidates & ~bit))
+
+        out = []
+        for _, _, chosen in sorted(best, key=lambda entry: (-entry[0], -entry[1])):
+            trs = (tr for i, tr in enumerate(pending_list) if chosen >> i & 1)
+            if max_count is not None:
+                trs = itertools.islice(trs, max_count)
+            out.append((TransactionSet(trs), 1))
+        return out
 
 
 class MaximalSchedulerFactory(TransactionSchedulerFactory):
@@ -186,36 +265,73 @@ class TournamentScheduler(AbstractScheduler):
 
     def schedule(
         self,
-        ongoing: TransactionSet,
         pending: Iterable[Transaction],
         max_count: Optional[int],
     ) -> Iterable[Tuple[TransactionSet, int]]:
         """See AbstractScheduler.schedule.
 
-        Filters out all transactions that conflict with currently running ones, then
-        checks the available transactions pairwise against each other repeatedly, until
-        a single non-conflicting group remains.
+        Checks the pending transactions pairwise against each other repeatedly, until a
+        single non-conflicting group remains.
         """
-        sets = [TransactionSet([tr]) for tr in pending if ongoing.compatible(tr)]
-        rounds = 0
-        while len(sets) > 1:
-            for t1, t2 in itertools.zip_longest(sets[::2], sets[1::2]):
-                if t2 is not None and t1.compatible(t2):
-                    t1 |= t2
-            if self.comparator_limit is None:
-                rounds += 1
-            else:
-                rounds += int(math.ceil(len(sets) / (2 * self.comparator_limit)))
-            sets = sets[::2]
-        if not sets:
-            candidates = TransactionSet()
-        elif max_count is None:
-            candidates = sets[0]
+        available = list(pending)
+        if max_count == 1:
+            # The winning group always starts with the first transaction, so there is
+            # no need to run the merges if only one transaction is kept.
+            candidates = TransactionSet(available[:1])
         else:
-            candidates = TransactionSet(itertools.islice(sets[0], max_count))
-        steps = max(1, rounds) if self.is_pipelined else 1
+            candidates = self.merge(available, max_count)
+        steps = max(1, self.merge_rounds(len(available))) if self.is_pipelined else 1
         return [(candidates, steps)]
 
+    def merge(
+        self, available: Sequence[Transaction], max_count: Optional[int]
+    ) -> TransactionSet:
+        """Return the group that remains after repeated pairwise merging."""
+        # Groups are kept as parallel lists of read and write bit vectors and member
+        # bit masks (bit i stands for available[i]), which are cheap to merge.
+        reads = [tr.read_bits for tr in available]
+        writes = [tr.write_bits for tr in available]
+        members = [1 << i for i in range(len(available))]
+        n = len(members)
+        while n > 1:
+            # Merge pairs into the front of the lists, instead of slicing them.
+            for i in range(0, n - 1, 2):
+                r1, w1, r2, w2 = reads[i], writes[i], reads[i + 1], writes[i + 1]
+                j = i // 2
+                if not (r2 & w1 or w2 & (r1 | w1)):
+                    reads[j] = r1 | r2
+                    writes[j] = w1 | w2
+                    members[j] = members[i] | members[i + 1]
+                else:
+                    reads[j] = r1
+                    writes[j] = w1
+                    members[j] = members[i]
+            if n % 2:
+                reads[n // 2] = reads[n - 1]
+                writes[n // 2] = writes[n - 1]
+                members[n // 2] = members[n - 1]
+            n = (n + 1) // 2
+        winners = (
+            (tr for i, tr in enumerate(available) if members[0] >> i & 1) if n else ()
+        )
+        if max_count is not None:
+            winners = itertools.islice(winners, max_count)
+        return TransactionSet(winners)
+
+    def merge_rounds(self, count: int) -> int:
+        """Return the number of comparator rounds needed to merge count groups."""
+        if count <= 1:
+            return 0
+        # Each merge step halves the number of groups (rounding up).
+        depth = (count - 1).bit_length()
+        if self.comparator_limit is None:
+            return depth
+        # Step k merges ceil(count / 2^k) groups with 2 * comparator_limit inputs per
+        # round, and nested ceiling divisions can be folded into one.
+        return sum(
+            -(-count // (self.comparator_limit << (k + 1))) for k in range(depth)
+        )
+
 
 class TournamentSchedulerFactory(TransactionSchedulerFactory):
     """Factory for greedy schedulers."""
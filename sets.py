@@ -5,11 +5,14 @@ from __future__ import annotations
 from typing import (
     AbstractSet,
     Callable,
+    Dict,
+    Hashable,
     Iterable,
     Iterator,
     List,
     MutableMapping,
     Optional,
+    Tuple,
 )
 
 from api import ObjSet, ObjSetMaker, ObjSetMakerFactory
@@ -26,21 +29,96 @@ def default_hash(i: int, x: int, n: int):
     return (x + i) % n
 
 
-class IdealObjSet(set, ObjSet):  # type: ignore
-    """Wrapper around the built-in set."""
+class IdInterner:
+    """Assigns small, dense integer ids to objects in the order they are seen."""
+
+    def __init__(self):
+        """Initialize an empty id table."""
+        self.ids: Dict[Hashable, int] = {}
+
+    def intern(self, obj: Hashable) -> int:
+        """Return the id of the object (a new one if it was not seen before)."""
+        ids = self.ids
+        return ids.setdefault(obj, len(ids))
+
+
+class IdealObjSet(frozenset, ObjSet):  # type: ignore
+    """Wrapper around the built-in frozenset.
+
+    Each object is mapped to its own bit, so bit vectors stay as narrow as the
+    number of distinct objects, however sparse the addresses are.
+    """
+
+    __slots__ = ("bits",)
+
+    def __new__(
+        cls, objects: Iterable[int] = (), bit_indices: Optional[IdInterner] = None, /
+    ) -> IdealObjSet:
+        """Create the set (frozenset only accepts the objects)."""
+        return super().__new__(cls, objects)
+
+    def __init__(
+        self, objects: Iterable[int] = (), bit_indices: Optional[IdInterner] = None, /
+    ):
+        """Initialize the bit vector of the set.
+
+        Arguments:
+            objects: objects in the set
+            bit_indices: bit positions of objects, which have to be shared by sets
+                         that are checked against each other (new if None)
+        """
+        bits = 0
+        intern = (IdInterner() if bit_indices is None else bit_indices).intern
+        for obj in self:
+            bits |= 1 << intern(obj)
+        self.bits = bits
+
+    def copy(self) -> IdealObjSet:
+        """See ObjSet.copy (the set is immutable, so it is its own copy)."""
+        return self
 
 
 class IdealObjSetMaker(ObjSetMaker):
-    """Wrapper around the built-in set class."""
+    """Wrapper around the built-in frozenset class."""
+
+    def __init__(self):
+        """Initialize the tables of this maker.
+
+        They belong to the maker (and so to a single simulation), so that bit vectors
+        only get as wide as the number of objects used in that simulation.
+        """
+        # Bit positions of objects, shared so that all sets of this maker agree.
+        self.bit_indices = IdInterner()
+        # Shared instance of each set made so far.
+        self.sets: Dict[frozenset, IdealObjSet] = {}
 
     def __call__(self, objects: Iterable[int] = ()) -> IdealObjSet:
-        """Return new built-in set."""
-        return IdealObjSet(objects)
+        """Return (interned) built-in frozenset."""
+        if isinstance(objects, IdealObjSet):
+            # Already immutable, no need to copy it.
+            return objects
+        key = frozenset(objects)
+        obj_set = self.sets.get(key)
+        if obj_set is None:
+            obj_set = self.sets[key] = IdealObjSet(key, self.bit_indices)
+        return obj_set
 
     def free_objects(self, objects: Iterable[int]) -> None:
         """See ObjSetMaker.free_objects."""
         pass
 
+    def snapshot(self) -> IdealObjSetMaker:
+        """See ObjSetMaker.snapshot.
+
+        The maker only caches results, which don't depend on the order of calls, so
+        it can be shared.
+        """
+        return self
+
+    def fingerprint(self) -> Hashable:
+        """See ObjSetMaker.fingerprint (all states make the same sets)."""
+        return None
+
 
 class IdealObjSetMakerFactory(ObjSetMakerFactory):
     """Factory for (wrapped) built-in sets."""
@@ -57,6 +135,8 @@ class IdealObjSetMakerFactory(ObjSetMakerFactory):
 class ApproximateObjSet(ObjSet):
     """Bloom filter-like implementation of an integer set."""
 
+    __slots__ = ("bits", "size")
+
     def __init__(self, objects: Iterable[int] = (), /, *, size: int):
         """Initialize set to contain objects."""
         self.bits = 0
@@ -83,8 +163,9 @@ class ApproximateObjSet(ObjSet):
     def __or__(self, other: AbstractSet) -> ApproximateObjSet:
         """Return the union of this set and the other set."""
         if isinstance(other, ApproximateObjSet):
-            out = ApproximateObjSet(size=self.size)
+            out = ApproximateObjSet.__new__(ApproximateObjSet)
             out.bits = self.bits | other.bits
+            out.size = self.size
             return out
         else:
             raise TypeError(
@@ -94,8 +175,9 @@ class ApproximateObjSet(ObjSet):
     def __and__(self, other: AbstractSet) -> ApproximateObjSet:
         """Return the intersection of this set and the other set."""
         if isinstance(other, ApproximateObjSet):
-            out = ApproximateObjSet(size=self.size)
+            out = ApproximateObjSet.__new__(ApproximateObjSet)
             out.bits = self.bits & other.bits
+            out.size = self.size
             return out
         else:
             raise TypeError(
@@ -104,8 +186,9 @@ class ApproximateObjSet(ObjSet):
 
     def copy(self):
         """See ObjSet.copy."""
-        copied = ApproximateObjSet(size=self.size)
+        copied = ApproximateObjSet.__new__(ApproximateObjSet)
         copied.bits = self.bits
+        copied.size = self.size
         return copied
 
 
@@ -124,6 +207,14 @@ class ApproximateObjSetMaker(ObjSetMaker):
         """See ObjSetMaker.free_objects."""
         pass
 
+    def snapshot(self) -> ApproximateObjSetMaker:
+        """See ObjSetMaker.snapshot (the maker is stateless, so it can be shared)."""
+        return self
+
+    def fingerprint(self) -> Hashable:
+        """See ObjSetMaker.fingerprint (the maker is stateless)."""
+        return None
+
 
 class ApproximateObjSetMakerFactory(ObjSetMakerFactory):
     """Factory for approximate set maker instances with preset arguments."""
@@ -149,6 +240,8 @@ class ApproximateObjSetMakerFactory(ObjSetMakerFactory):
 class FiniteObjSet(ObjSet):
     """Fixed-size set with a global renaming table."""
 
+    __slots__ = ("bits", "objs", "size", "table")
+
     def __init__(
         self,
         objects: Iterable[int] = (),
@@ -198,8 +291,11 @@ class FiniteObjSet(ObjSet):
     def __or__(self, other: AbstractSet) -> FiniteObjSet:
         """Return the union of this set and the other set."""
         if isinstance(other, FiniteObjSet):
-            out = FiniteObjSet(size=self.size, renaming_table=self.table)
+            out = FiniteObjSet.__new__(FiniteObjSet)
             out.bits = self.bits | other.bits
+            out.objs = [-1] * self.size
+            out.size = self.size
+            out.table = self.table
             return out
         else:
             raise TypeError(
@@ -209,8 +305,11 @@ class FiniteObjSet(ObjSet):
     def __and__(self, other: AbstractSet) -> FiniteObjSet:
         """Return the intersection of this set and the other set."""
         if isinstance(other, FiniteObjSet):
-            out = FiniteObjSet(size=self.size, renaming_table=self.table)
+            out = FiniteObjSet.__new__(FiniteObjSet)
             out.bits = self.bits & other.bits
+            out.objs = [-1] * self.size
+            out.size = self.size
+            out.table = self.table
             return out
         else:
             raise TypeError(
@@ -219,9 +318,11 @@ class FiniteObjSet(ObjSet):
 
     def copy(self):
         """See ObjSet.copy."""
-        copied = FiniteObjSet(size=self.size, renaming_table=self.table)
+        copied = FiniteObjSet.__new__(FiniteObjSet)
         copied.bits = self.bits
         copied.objs = self.objs
+        copied.size = self.size
+        copied.table = self.table
         return copied
 
 
@@ -233,7 +334,10 @@ class FiniteObjSetMaker(ObjSetMaker, MutableMapping[int, int]):
         self.size = factory.size
         self.hash_fn = factory.hash_fn
         self.n_hash_funcs = factory.n_hash_funcs
-        self.table = [(-1, 0)] * factory.size
+        # Renaming table, stored as parallel lists of objects (-1 if the slot is
+        # free) and reference counts, so that updating a slot allocates nothing.
+        self.table_objs = [-1] * factory.size
+        self.table_counts = [0] * factory.size
         self.history: List[int] = []
 
     def __call__(self, objects: Iterable[int] = ()) -> FiniteObjSet:
@@ -245,38 +349,66 @@ class FiniteObjSetMaker(ObjSetMaker, MutableMapping[int, int]):
         for obj in objects:
             del self[obj]
 
+    def snapshot(self) -> FiniteObjSetMaker:
+        """See ObjSetMaker.snapshot.
+
+        The renaming table is copied, but the history of renaming steps (only used
+        for statistics) is shared.
+        """
+        new = FiniteObjSetMaker.__new__(FiniteObjSetMaker)
+        new.size = self.size
+        new.hash_fn = self.hash_fn
+        new.n_hash_funcs = self.n_hash_funcs
+        new.table_objs = list(self.table_objs)
+        new.table_counts = list(self.table_counts)
+        new.history = self.history
+        return new
+
+    def fingerprint(self) -> Hashable:
+        """See ObjSetMaker.fingerprint."""
+        return (tuple(self.table_objs), tuple(self.table_counts))
+
     def __getitem__(self, obj: int) -> int:
         """Return name for object smaller than the table size."""
         assert obj != -1
-        for i in range(self.n_hash_funcs):
-            h = self.hash_fn(i, obj, self.size)
-            prev_obj, count = self.table[h]
-            if prev_obj == -1:
-                self.table[h] = (obj, 1)
-            elif prev_obj == obj:
-                self.table[h] = (obj, count + 1)
-            else:
-                continue
-            self.history.append(i + 1)
-            return h
-        raise KeyError("renaming table is full")
+        found = self._find_slot(obj, take_free=True)
+        if found is None:
+            raise KeyError("renaming table is full")
+        i, h = found
+        if self.table_objs[h] == -1:
+            self.table_objs[h] = obj
+        self.table_counts[h] += 1
+        self.history.append(i + 1)
+        return h
 
     def __delitem__(self, obj: int) -> None:
         """Remove an object from the renaming table."""
         assert obj != -1
-        for i in range(self.n_hash_funcs):
-            h = self.hash_fn(i, obj, self.size)
-            prev_obj, count = self.table[h]
-            assert prev_obj != -1 and count > 0 or prev_obj == -1 and count == 0
-            if prev_obj == obj and count == 1:
-                self.table[h] = (-1, 0)
-            elif prev_obj == obj and count > 1:
-                self.table[h] = (obj, count - 1)
-            else:
-                continue
-            break
-        else:
+        found = self._find_slot(obj, take_free=False)
+        if found is None:
             raise KeyError("object not found")
+        _, h = found
+        assert self.table_counts[h] > 0
+        self.table_counts[h] -= 1
+        if self.table_counts[h] == 0:
+            self.table_objs[h] = -1
+
+    def _find_slot(self, obj: int, take_free: bool) -> Optional[Tuple[int, int]]:
+        """Return the probe index and the slot holding obj, or None if not found.
+
+        Arguments:
+            obj: object to look up
+            take_free: whether to stop at the first free slot as well
+        """
+        objs, size = self.table_objs, self.size
+        # The default hash is inlined, since it is computed for every probe.
+        hash_fn = None if self.hash_fn is default_hash else self.hash_fn
+        for i in range(self.n_hash_funcs):
+            h = (obj + i) % size if hash_fn is None else hash_fn(i, obj, size)
+            prev_obj = objs[h]
+            if prev_obj == obj or take_free and prev_obj == -1:
+                return i, h
+        return None
 
     def __setitem__(self, obj: int, name: int) -> None:
         """Not implemented."""
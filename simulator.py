@@ -1,8 +1,10 @@
 """Main Puppetmaster simulator class."""
 
+from __future__ import annotations
+
 import dataclasses
 import heapq
-from typing import List
+from typing import Hashable, List, Optional, Set
 
 from api import ObjSetMaker, TransactionExecutor, TransactionScheduler
 from generator import TransactionGenerator
@@ -14,7 +16,20 @@ class SimulatorState:
     """Internal state of the simulator."""
 
     time: int
-    path: List[MachineState] = dataclasses.field(compare=False)
+    state: MachineState = dataclasses.field(compare=False)
+    # Previous state on the path, shared with sibling paths instead of copied.
+    parent: Optional[SimulatorState] = dataclasses.field(compare=False, default=None)
+
+    @property
+    def path(self) -> List[MachineState]:
+        """Return the states on the path leading to (and including) this state."""
+        path = []
+        node: Optional[SimulatorState] = self
+        while node is not None:
+            path.append(node.state)
+            node = node.parent
+        path.reverse()
+        return path
 
 
 class Simulator:
@@ -54,22 +69,33 @@ class Simulator:
             amount of time (cycles) it took to execute all transactions
         """
         steps = 0
-        queue = [SimulatorState(0, [self.start_state])]
+        queue = [SimulatorState(0, self.start_state)]
+        # States can only be reached along multiple paths once the search branches.
+        branched = False
+        visited: Set[Hashable] = set()
         while queue:
             steps += 1
 
             # Get next state off the queue.
             cur = heapq.heappop(queue)
-            state = cur.path[-1]
+            state = cur.state
+
+            if branched:
+                fingerprint = state.fingerprint()
+                if fingerprint in visited:
+                    # An equivalent state has already been explored.
+                    continue
+                visited.add(fingerprint)
 
             if verbose >= 3:
                 print(cur.time, steps, len(queue), end="\r")
 
             if not state:
                 # Nothing to do, path ended.
+                path = cur.path
                 if verbose >= 2:
-                    print(f"{len(cur.path)} states, {steps} steps, {len(queue)} queued")
-                return cur.path
+                    print(f"{len(path)} states, {steps} steps, {len(queue)} queued")
+                return path
             elif len(state.cores) < state.core_count and state.scheduled:
                 # Some cores are idle and there are transactions scheduled.
                 next_states = self.executor.run(state)
@@ -85,13 +111,14 @@ class Simulator:
                 next_states = self.scheduler.run(state)
 
             # Push "child" states onto queue.
+            if len(next_states) > 1:
+                branched = True
             for next_state in next_states:
                 time = (
                     min(next_state.clock, next_state.cores[0].clock)
                     if next_state.cores
                     else next_state.clock
                 )
-                next_path = cur.path + [next_state]
-                heapq.heappush(queue, SimulatorState(time, next_path))
+                heapq.heappush(queue, SimulatorState(time, next_state, cur))
 
         raise RuntimeError  # We should never get here.
@@ -1,15 +1,27 @@
 """Unit tests for puppetmaster."""
+import heapq
+import itertools
+import math
+import random
 import unittest
-from typing import Generator, Iterable
-from unittest import TestCase
-
-from api import ObjSetMaker
-from executors import RandomExecutor
-from pmtypes import Transaction
-from schedulers import GreedySchedulerFactory
-from sets import IdealObjSetMaker
+from typing import Generator, Iterable, List, Optional
+from unittest import TestCase, mock
+
+from api import ObjSet, ObjSetMaker
+from executors import OptimalExecutor, RandomExecutor
+from generator import TransactionGenerator
+from pmtypes import MachineState, Transaction, TransactionSet
+from schedulers import (
+    GreedyScheduler,
+    GreedySchedulerFactory,
+    MaximalSchedulerFactory,
+    TournamentSchedulerFactory,
+)
+from sets import FiniteObjSetMakerFactory, IdealObjSetMaker, default_hash
 from simulator import Simulator
 
+OBJ_SET_MAKER = IdealObjSetMaker()
+
 
 class TestTransactionGenerator(Generator[Transaction, ObjSetMaker, None]):
     """TransactionGenerator implementation for tests."""
@@ -62,42 +74,366 @@ class TestSimple(TestCase):
 
     def test_01(self):
         """Single transaction without objects."""
-        tr = Transaction(set(), set(), 42)
+        tr = Transaction(OBJ_SET_MAKER(), OBJ_SET_MAKER(), "", 42, 0)
         self._validate_transactions(tr.time, {tr})
 
     def test_02(self):
         """Single transaction with non-empty read and write sets."""
-        tr = Transaction({1, 2}, {3}, 77)
+        tr = Transaction(OBJ_SET_MAKER({1, 2}), OBJ_SET_MAKER({3}), "", 77, 0)
         self._validate_transactions(tr.time, {tr})
 
     def test_03(self):
         """Two independent transactions running serially."""
-        tr1 = Transaction({1}, {2}, 12)
-        tr2 = Transaction({3}, {4}, 23)
+        tr1 = Transaction(OBJ_SET_MAKER({1}), OBJ_SET_MAKER({2}), "", 12, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({3}), OBJ_SET_MAKER({4}), "", 23, 0)
         expected = tr1.time + tr2.time
         self._validate_transactions(expected, {tr1, tr2})
 
     def test_04(self):
         """Two independent transactions running concurrently."""
-        tr1 = Transaction({1}, {2}, 12)
-        tr2 = Transaction({3}, {4}, 23)
+        tr1 = Transaction(OBJ_SET_MAKER({1}), OBJ_SET_MAKER({2}), "", 12, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({3}), OBJ_SET_MAKER({4}), "", 23, 0)
         expected = max(tr1.time, tr2.time)
         self._validate_transactions(expected, {tr1, tr2}, n_cores=2)
 
     def test_05(self):
         """Two transactions reading the same object."""
-        tr1 = Transaction({1, 2}, {3}, 31)
-        tr2 = Transaction({1, 4}, {5}, 26)
+        tr1 = Transaction(OBJ_SET_MAKER({1, 2}), OBJ_SET_MAKER({3}), "", 31, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({1, 4}), OBJ_SET_MAKER({5}), "", 26, 0)
         expected = max(tr1.time, tr2.time)
         self._validate_transactions(expected, {tr1, tr2}, n_cores=2)
 
     def test_06(self):
         """Two transactions writing the same object."""
-        tr1 = Transaction({1, 2}, {3, 4}, 31)
-        tr2 = Transaction({5}, {3}, 26)
+        tr1 = Transaction(OBJ_SET_MAKER({1, 2}), OBJ_SET_MAKER({3, 4}), "", 31, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({5}), OBJ_SET_MAKER({3}), "", 26, 0)
         expected = tr1.time + tr2.time
         self._validate_transactions(expected, {tr1, tr2}, n_cores=2)
 
 
+class TestTransactionSet(TestCase):
+    """Tests for the combined bit vectors of transaction sets."""
+
+    def test_remove_shared_objects(self):
+        """Removing a transaction keeps the objects that others still use."""
+        tr1 = Transaction(OBJ_SET_MAKER({1, 2}), OBJ_SET_MAKER({3}), "", 1, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({2}), OBJ_SET_MAKER({3, 4}), "", 1, 0)
+        tr3 = Transaction(OBJ_SET_MAKER({4}), OBJ_SET_MAKER({5}), "", 1, 0)
+        trs = TransactionSet([tr1, tr2, tr3])
+        trs.discard(tr1)
+        self.assertEqual(tr2.read_bits | tr3.read_bits, trs.read_bits)
+        self.assertEqual(tr2.write_bits | tr3.write_bits, trs.write_bits)
+        # Object 3 is still written by tr2.
+        self.assertFalse(trs.compatible(tr1))
+        trs -= {tr2}
+        self.assertEqual(tr3.read_bits, trs.read_bits)
+        self.assertEqual(tr3.write_bits, trs.write_bits)
+        self.assertTrue(trs.compatible(tr1))
+
+
+class TestGreedyScheduler(TestCase):
+    """Tests for the greedy scheduler."""
+
+    def test_smallest_first(self):
+        """Trying smaller transactions first can schedule more of them."""
+        big = Transaction(OBJ_SET_MAKER(), OBJ_SET_MAKER({1, 2}), "", 1, 0)
+        small1 = Transaction(OBJ_SET_MAKER(), OBJ_SET_MAKER({1}), "", 1, 0)
+        small2 = Transaction(OBJ_SET_MAKER(), OBJ_SET_MAKER({2}), "", 1, 0)
+        pending = [big, small1, small2]
+        [(in_order, _)] = GreedySchedulerFactory()().schedule(pending, None)
+        self.assertEqual({big}, set(in_order))
+        [(smallest, _)] = GreedySchedulerFactory(True)().schedule(pending, None)
+        self.assertEqual({small1, small2}, set(smallest))
+        [(direct, _)] = GreedyScheduler(0, None, None).schedule(pending, None)
+        self.assertEqual({big}, set(direct))
+
+
+def random_transactions(rng: random.Random, count: int) -> List[Transaction]:
+    """Return transactions on few objects, so that many of them conflict."""
+    return [
+        Transaction(
+            OBJ_SET_MAKER(rng.sample(range(8), rng.randint(0, 2))),
+            OBJ_SET_MAKER(rng.sample(range(8), rng.randint(0, 2))),
+            "",
+            1,
+            0,
+        )
+        for _ in range(count)
+    ]
+
+
+class TestMaximalScheduler(TestCase):
+    """Compare the maximal scheduler with an exhaustive search."""
+
+    @staticmethod
+    def _reference(
+        pending: List[Transaction], n_schedules: int, max_count: Optional[int]
+    ) -> List[set]:
+        """Return the n_schedules largest compatible sets by brute force.
+
+        Subsets are generated excluding each transaction before including it, and
+        ties are kept in that order. Sets are truncated to their first max_count
+        transactions in pending order.
+        """
+
+        def subsets(chosen: List[Transaction], i: int):
+            if i == len(pending):
+                yield chosen
+                return
+            yield from subsets(chosen, i + 1)
+            if TransactionSet(chosen).compatible(pending[i]):
+                yield from subsets(chosen + [pending[i]], i + 1)
+
+        largest = heapq.nlargest(n_schedules, subsets([], 0), key=len)
+        return [set(chosen[:max_count]) for chosen in largest]
+
+    def test_random_pools(self):
+        """Same sets in the same order as brute force, with and without truncation."""
+        rng = random.Random(0)
+        for n_schedules in (1, 2, 3, 5):
+            sched = MaximalSchedulerFactory(n_schedules)()
+            for _ in range(100):
+                pending = random_transactions(rng, rng.randint(0, 10))
+                for max_count in (None, 1, 2, 3):
+                    expected = self._reference(pending, n_schedules, max_count)
+                    result = sched.schedule(pending, max_count)
+                    self.assertEqual(expected, [set(trs) for trs, _ in result])
+                    self.assertTrue(all(steps == 1 for _, steps in result))
+
+    def test_ties(self):
+        """Equally large sets are returned in the order an exhaustive search finds."""
+        a, b, c, d = (OBJ_SET_MAKER({i}) for i in range(4))
+        # The first two and the next two transactions write the same object, so
+        # there are four largest sets, each with one transaction from both pairs.
+        pending = [
+            Transaction(OBJ_SET_MAKER(), a, "", 1, 0),
+            Transaction(OBJ_SET_MAKER(), a, "", 1, 0),
+            Transaction(OBJ_SET_MAKER(), b, "", 1, 0),
+            Transaction(OBJ_SET_MAKER(), b, "", 1, 0),
+            Transaction(c, d, "", 1, 0),
+        ]
+        sched = MaximalSchedulerFactory(5)()
+        expected = self._reference(pending, 5, None)
+        self.assertEqual([3] * 4 + [2], [len(trs) for trs in expected])
+        result = sched.schedule(pending, None)
+        self.assertEqual(expected, [set(trs) for trs, _ in result])
+
+
+class TestTournamentScheduler(TestCase):
+    """Compare the tournament scheduler with a pairwise merge of transaction sets."""
+
+    def test_merge(self):
+        """Merging bit vectors keeps the same group as merging TransactionSets."""
+        rng = random.Random(0)
+        sched = TournamentSchedulerFactory()()
+        for _ in range(300):
+            available = random_transactions(rng, rng.randint(0, 20))
+            sets = [TransactionSet([tr]) for tr in available]
+            while len(sets) > 1:
+                for t1, t2 in itertools.zip_longest(sets[::2], sets[1::2]):
+                    if t2 is not None and all(t1.compatible(tr) for tr in t2):
+                        for tr in t2:
+                            t1.add(tr)
+                sets = sets[::2]
+            winners = [tr for tr in available if sets and tr in sets[0]]
+            for max_count in (None, 1, 2, 3):
+                self.assertEqual(
+                    set(winners[:max_count]), set(sched.merge(available, max_count))
+                )
+
+    def test_merge_rounds(self):
+        """Closed-form round counts match halving the number of groups."""
+        for comparator_limit in (None, 1, 2, 3, 5):
+            sched = TournamentSchedulerFactory(comparator_limit)()
+            for count in range(300):
+                rounds = 0
+                n = count
+                while n > 1:
+                    if comparator_limit is None:
+                        rounds += 1
+                    else:
+                        rounds += int(math.ceil(n / (2 * comparator_limit)))
+                    n = (n + 1) // 2
+                self.assertEqual(rounds, sched.merge_rounds(count))
+
+
+class TestRenamingTable(TestCase):
+    """Tests for the renaming table of fixed-size sets."""
+
+    def test_inlined_default_hash(self):
+        """Inlined default hash probes the same slots as calling default_hash."""
+        inlined = FiniteObjSetMakerFactory(8)()
+        called = FiniteObjSetMakerFactory(8, lambda i, x, n: default_hash(i, x, n))()
+        for objs in ([3, 11, 19], [3, 27], [5, 13, 21, 29], [11]):
+            for maker in (inlined, called):
+                for obj in objs:
+                    maker[obj]
+            self.assertEqual(called.table_objs, inlined.table_objs)
+            self.assertEqual(called.table_counts, inlined.table_counts)
+        for obj in (3, 19, 13, 3):
+            del inlined[obj]
+            del called[obj]
+            self.assertEqual(called.table_objs, inlined.table_objs)
+            self.assertEqual(called.table_counts, inlined.table_counts)
+        self.assertEqual(called.history, inlined.history)
+
+
+class TestIdealObjSetMaker(TestCase):
+    """Tests for sets with one bit per object."""
+
+    def test_bits_per_maker(self):
+        """Bit vectors only grow with the objects used by the same maker."""
+        first = IdealObjSetMaker()
+        self.assertEqual(0b11, first(range(100, 102)).bits)
+        self.assertIs(first([100, 101]), first([101, 100]))
+        self.assertEqual(0b100, first([5]).bits)
+        # A new maker (as used by the next simulation) starts from the lowest bit.
+        self.assertEqual(0b1, IdealObjSetMaker()([5]).bits)
+
+
+class TestTransactionGeneratorOverflow(TestCase):
+    """Tests for retrying transactions that overflow the renaming table."""
+
+    def test_retry_after_second_overflow(self):
+        """A deferred transaction that overflows again is retried later."""
+        tr_data = [
+            ("a", {"reads": 0, "writes": 2, "time": 1}),
+            ("b", {"reads": 0, "writes": 1, "time": 1}),
+            ("c", {"reads": 1, "writes": 0, "time": 1}),
+        ]
+        gen = TransactionGenerator(tr_data, [0, 1, 2, 0])
+        maker = FiniteObjSetMakerFactory(2)()
+        tr_a = gen.send(maker)
+        self.assertIsNone(gen.send(maker))  # "b" doesn't fit next to "a".
+        tr_c = gen.send(maker)
+        self.assertEqual("c", tr_c.label)
+        gen.reset_overflows()
+        self.assertIsNone(gen.send(maker))  # "b" still doesn't fit.
+        maker.free(tr_a)
+        maker.free(tr_c)
+        gen.reset_overflows()
+        tr_b = gen.send(maker)
+        self.assertEqual("b", tr_b.label)
+        self.assertEqual([], list(iter(tr_b.read_set)))
+        self.assertEqual([2], list(iter(tr_b.write_set)))
+        self.assertFalse(gen)
+
+
+class TestMinimalComponents(TestCase):
+    """Tests for components that only implement the abstract methods."""
+
+    def test_branching_search(self):
+        """Components without snapshot and fingerprint can be used for search."""
+
+        class MinimalObjSetMaker(ObjSetMaker):
+            def __call__(self, objects: Iterable[int] = ()) -> ObjSet:
+                return OBJ_SET_MAKER(objects)
+
+            def free_objects(self, objects: Iterable[int]) -> None:
+                pass
+
+        tr1 = Transaction(OBJ_SET_MAKER({1}), OBJ_SET_MAKER({2}), "", 12, 0)
+        tr2 = Transaction(OBJ_SET_MAKER({3}), OBJ_SET_MAKER({2}), "", 5, 0)
+        tr3 = Transaction(OBJ_SET_MAKER({1}), OBJ_SET_MAKER({4}), "", 7, 0)
+        sim = Simulator(
+            TestTransactionGenerator([tr1, tr2, tr3]),
+            MinimalObjSetMaker(),
+            GreedySchedulerFactory()(),
+            OptimalExecutor(),
+            1,
+        )
+        self.assertEqual(24, sim.run()[-1].clock)
+
+
+class TestOptimalExecutor(TestCase):
+    """Tests for the exhaustive execution policy."""
+
+    def test_equivalent_transactions(self):
+        """Only one of two interchangeable transactions is started."""
+        # The renaming table makes a new set object for each transaction.
+        obj_set_maker = FiniteObjSetMakerFactory(8)()
+        trs = [
+            Transaction(obj_set_maker([1]), obj_set_maker([2]), "", 3, 0)
+            for _ in range(2)
+        ]
+        self.assertIsNot(trs[0].read_set, trs[1].read_set)
+        state = MachineState(TestTransactionGenerator([]), obj_set_maker)
+        state.scheduled.update(trs)
+        self.assertEqual(1, len(OptimalExecutor().run(state)))
+        # A transaction on other objects still leads to a different state.
+        state.scheduled.add(
+            Transaction(obj_set_maker([1]), obj_set_maker([3]), "", 3, 0)
+        )
+        self.assertEqual(2, len(OptimalExecutor().run(state)))
+
+
+class TestStateDeduplication(TestCase):
+    """Tests for skipping equivalent states in the simulator search."""
+
+    def test_same_result_without_deduplication(self):
+        """Skipping states with equal fingerprints doesn't change the final clock."""
+        tr_data = [
+            ("a", {"reads": 1, "writes": 1, "time": 3}),
+            ("b", {"reads": 0, "writes": 2, "time": 2}),
+            ("c", {"reads": 1, "writes": 1, "time": 5}),
+            ("d", {"reads": 0, "writes": 2, "time": 1}),
+            ("e", {"reads": 1, "writes": 1, "time": 2}),
+        ]
+        addresses = [0, 1, 2, 3, 1, 4, 5, 6, 0, 2]
+
+        def run():
+            # The renaming table is too small for all transactions, so they overflow
+            # on some branches, and both the scheduler and the executor branch.
+            sim = Simulator(
+                TransactionGenerator(tr_data, addresses),
+                FiniteObjSetMakerFactory(4)(),
+                MaximalSchedulerFactory(16)(1, 3, None),
+                OptimalExecutor(),
+                2,
+            )
+            return sim.run()[-1].clock
+
+        deduplicated = run()
+        # Make every state look different, so that none of them are skipped.
+        with mock.patch.object(MachineState, "fingerprint", lambda self: object()):
+            exhaustive = run()
+        self.assertEqual(exhaustive, deduplicated)
+
+    def test_order_dependent_schedulers(self):
+        """Skipped states don't change which transactions the schedulers pick."""
+        rng = random.Random(0)
+        for factory in [GreedySchedulerFactory(), TournamentSchedulerFactory()]:
+            for _ in range(20):
+                tr_data = [
+                    (
+                        "",
+                        {
+                            "reads": rng.randint(0, 2),
+                            "writes": rng.randint(0, 2),
+                            "time": rng.randint(1, 5),
+                        },
+                    )
+                    for _ in range(6)
+                ]
+                addresses = [rng.randrange(6) for _ in range(24)]
+
+                def run():
+                    sim = Simulator(
+                        TransactionGenerator(tr_data, addresses),
+                        IdealObjSetMaker(),
+                        factory(1, 4, None),
+                        OptimalExecutor(),
+                        2,
+                    )
+                    return sim.run()[-1].clock
+
+                deduplicated = run()
+                with mock.patch.object(
+                    MachineState, "fingerprint", lambda self: object()
+                ):
+                    exhaustive = run()
+                self.assertEqual(exhaustive, deduplicated)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)